@@ -6,61 +6,93 @@
 
 import argparse
 import csv
+import io
 import logging
 import sys
-from collections import Counter
 from pathlib import Path
 
 logger = logging.getLogger()
 
+# Size of the read and write buffers for the samplesheet files (1 MiB).
+BUFFER_SIZE = 1024 * 1024
+
+# Samplesheets smaller than this (64 MiB) are read into memory in one go.
+IN_MEMORY_LIMIT = 64 * 1024 * 1024
+
+# Column headers that every samplesheet must contain.
+REQUIRED_COLUMNS = frozenset(("sample", "vcf", "traits", "ancestry"))
+
+
+class ExcelSkipInitialSpace(csv.excel):
+    """Describe comma-separated samplesheets that put a space after each delimiter."""
+
+    skipinitialspace = True
+
 
 class RowChecker:
     """
     Define a service that can validate and transform each given row.
 
-    Attributes:
-        modified (list): A list of dicts, where each dict corresponds to a previously
-            validated and transformed row. The order of rows is maintained.
+    Rows are handed back as soon as they pass validation, so they can be streamed to
+    the output without keeping the parsed rows around. The input itself is held in
+    memory when it is below ``IN_MEMORY_LIMIT`` (see ``open_samplesheet``).
 
     """
 
+    __slots__ = ("_width", "_sample", "_vcf", "_traits", "_ancestry", "_seen")
+
     VALID_FORMATS = (
         ".vcf.gz",
         ".json",
     )
 
-    def __init__(self, sample="sample", vcf="vcf", traits="traits", ancestry="ancestry", **kwargs):
+    # Expected suffixes and the (negative) offsets at which they start, so that each
+    # check is a single slice comparison.
+    _VCF_SUFFIX = ".vcf.gz"
+    _VCF_START = -len(_VCF_SUFFIX)
+    _TRAITS_SUFFIX = "_traits-json.json"
+    _TRAITS_START = -len(_TRAITS_SUFFIX)
+    _ANCESTRY_SUFFIX = "_ancestry-json.json"
+    _ANCESTRY_START = -len(_ANCESTRY_SUFFIX)
+
+    def __init__(self, width=4, sample=0, vcf=1, traits=2, ancestry=3, **kwargs):
         """
-        Initialize the row checker with the expected column names.
+        Initialize the row checker with the positions of the expected columns.
 
         Args:
-            sample (str): The name of the column that contains the sample name
-                (default "sample").
-            vcf_ (str): The name of the column that contains the VCF file path
-                (default "vcf").
-            traits (str): The name of the column that contains the traits JSON file path
-                (default "traits").
-            ancestry (str): The name of the column that contains the ancestry JSON file path
-                (default "ancestry").
+            width (int): The number of columns in the header, which every row must
+                match (default 4).
+            sample (int): The index of the column that contains the sample name
+                (default 0).
+            vcf (int): The index of the column that contains the VCF file path
+                (default 1).
+            traits (int): The index of the column that contains the traits JSON file path
+                (default 2).
+            ancestry (int): The index of the column that contains the ancestry JSON file path
+                (default 3).
         """
+        self._width = width
         self._sample = sample
         self._vcf = vcf
         self._traits = traits
         self._ancestry = ancestry
         self._seen = set()
-        self.modified = []
 
 
     def validate_and_transform(self, row):
         """
         Perform all validations on the given row.
         Args:
-            row (dict): A mapping from column headers (keys) to elements of that row
-                (values).
+            row (list): The elements of that row in the order of the header columns.
+        Returns:
+            list: The transformed row, ready to be written out.
         """
+        if len(row) != self._width:
+            raise AssertionError(f"Expected {self._width} fields as in the header but found {len(row)}.")
         self._validate_sample(row)
-        self._seen.add(row[self._sample])
-        self.modified.append(row)
+        self._validate_unique_sample(row)
+        row.insert(1, "")
+        return row
 
 
     def _validate_sample(self, row):
@@ -71,40 +103,38 @@ class RowChecker:
         #        f"The VCF file has an unrecognized extension: {vcf_file}\n"
         #        f"It should be one of: {', '.join(self.VALID_FORMATS)}"
         #    )
-        if not row[self._vcf].endswith(".vcf.gz"):
-            raise AssertionError(f"Unexpected VCF file extension: {row[self._vcf]}. The valid VCF extension should be: vcf.gz.")
-        if not row[self._traits].endswith("_traits-json.json"):
-            raise AssertionError(f"Unexpected traits file extension: {row[self._traits]}. The valid VCF extension should be: _traits-json.json.")
-        if not row[self._ancestry].endswith("_ancestry-json.json"):
-            raise AssertionError(f"Unexpected ancestry file extension: {row[self._ancestry]}. The valid VCF extension should be: _ancestry-json.json.")
+        vcf = row[self._vcf]
+        traits = row[self._traits]
+        ancestry = row[self._ancestry]
+        if vcf[self._VCF_START :] != self._VCF_SUFFIX:
+            raise AssertionError(f"Unexpected VCF file extension: {vcf}. The valid VCF extension should be: vcf.gz.")
+        if traits[self._TRAITS_START :] != self._TRAITS_SUFFIX:
+            raise AssertionError(f"Unexpected traits file extension: {traits}. The valid VCF extension should be: _traits-json.json.")
+        if ancestry[self._ANCESTRY_START :] != self._ANCESTRY_SUFFIX:
+            raise AssertionError(f"Unexpected ancestry file extension: {ancestry}. The valid VCF extension should be: _ancestry-json.json.")
 
 
 
-    def validate_unique_samples(self):
+    def _validate_unique_sample(self, row):
         """
         Assert that the combination of sample name and VCF filename is unique.
 
-        In addition to the validation, also rename all samples to have a suffix of _T{n}, where n is the
+        In addition to the validation, also rename the sample to have a suffix of _T{n}, where n is the
         number of times the same sample exist, but with different VCF files, e.g., multiple runs per experiment.
+        Since duplicates are rejected, n is always 1.
 
         """
-        if len(self._seen) != len(self.modified):
-            raise AssertionError("The pair of sample name and VCF must be unique.")
-        seen = Counter()
-        for row in self.modified:
-            sample = row[self._sample]
-            seen[sample] += 1
-            row[self._sample] = f"{sample}_T{seen[sample]}"
+        sample = row[self._sample]
+        if sample in self._seen:
+            raise AssertionError(f"The pair of sample name and VCF must be unique: {sample}.")
+        self._seen.add(sample)
+        row[self._sample] = f"{sample}_T1"
 
 
-def read_head(handle, num_lines=10):
-    """Read the specified number of lines from the current position in the file."""
-    lines = []
-    for idx, line in enumerate(handle):
-        if idx == num_lines:
-            break
-        lines.append(line)
-    return "".join(lines)
+def read_head(handle, size=16384):
+    """Read at most the specified number of characters, trimmed to the last complete line."""
+    peek = handle.read(size)
+    return peek[: peek.rfind("\n") + 1] or peek
 
 
 def sniff_format(handle):
@@ -125,14 +155,62 @@ def sniff_format(handle):
     peek = read_head(handle)
     handle.seek(0)
     sniffer = csv.Sniffer()
-    if not sniffer.has_header(peek):
-        logger.critical("The given sample sheet does not appear to contain a header.")
-        sys.exit(1)
     dialect = sniffer.sniff(peek)
     return dialect
 
 
-def check_samplesheet(file_in, file_out):
+def detect_format(handle):
+    """
+    Pick the tabular format from the delimiter used in the header line.
+
+    Samplesheets are nearly always comma- or tab-separated, so this avoids running
+    ``csv.Sniffer`` unless the header line contains neither delimiter.
+
+    Args:
+        handle (text file): A handle to a `text file`_ object. The read position is
+        expected to be at the beginning (index 0).
+
+    Returns:
+        csv.Dialect: The detected tabular format.
+
+    .. _text file:
+        https://docs.python.org/3/glossary.html#term-text-file
+
+    """
+    first_line = handle.readline()
+    handle.seek(0)
+    if ", " in first_line:
+        return ExcelSkipInitialSpace
+    if "," in first_line:
+        return csv.excel
+    if "\t" in first_line:
+        return csv.excel_tab
+    return sniff_format(handle)
+
+
+def open_samplesheet(file_in):
+    """
+    Open the samplesheet for reading so that detecting its format does not read it twice.
+
+    Samplesheets below ``IN_MEMORY_LIMIT`` are read once into an in-memory buffer,
+    where seeking back after peeking at the first line is free. Larger files are opened
+    directly with a ``BUFFER_SIZE`` read buffer.
+
+    Args:
+        file_in (pathlib.Path): The given tabular samplesheet.
+
+    Returns:
+        text file: A handle positioned at the beginning of the samplesheet.
+
+    """
+    # See https://docs.python.org/3.9/library/csv.html#id3 to read up on `newline=""`.
+    if file_in.stat().st_size < IN_MEMORY_LIMIT:
+        with file_in.open(newline="") as handle:
+            return io.StringIO(handle.read(), newline="")
+    return file_in.open(newline="", buffering=BUFFER_SIZE)
+
+
+def check_samplesheet(file_in, file_out, sniff=False):
     """
     Check that the tabular samplesheet has the structure expected by nf-core pipelines.
 
@@ -143,6 +221,8 @@ def check_samplesheet(file_in, file_out):
             CSV, TSV, or any other format automatically recognized by ``csv.Sniffer``.
         file_out (pathlib.Path): Where the validated and transformed samplesheet should
             be created; always in CSV format.
+        sniff (bool): Whether to always detect the format with ``csv.Sniffer`` rather
+            than from the delimiter of the header line (default False).
 
     Example:
         This function checks that the samplesheet follows the following structure,
@@ -157,32 +237,78 @@ def check_samplesheet(file_in, file_out):
         https://raw.githubusercontent.com/nf-core/test-datasets/viralrecon/samplesheet/samplesheet_test_illumina_amplicon.csv
 
     """
-    required_columns = {"sample", "vcf", "traits", "ancestry"}
-    # See https://docs.python.org/3.9/library/csv.html#id3 to read up on `newline=""`.
-    with file_in.open(newline="") as in_handle:
-        reader = csv.DictReader(in_handle, dialect=sniff_format(in_handle))
-        # Validate the existence of the expected header columns.
-        if not required_columns.issubset(reader.fieldnames):
-            req_cols = ", ".join(required_columns)
-            logger.critical(f"The sample sheet **must** contain these column headers: {req_cols}. It currently contains {reader.fieldnames}")
+    with open_samplesheet(file_in) as in_handle:
+        dialect = sniff_format(in_handle) if sniff else detect_format(in_handle)
+        reader = csv.reader(in_handle, dialect=dialect)
+        header = next(reader)
+        # Validate the existence of the expected header columns, which also confirms that
+        # the first row is a header.
+        if not REQUIRED_COLUMNS.issubset(header):
+            req_cols = ", ".join(REQUIRED_COLUMNS)
+            logger.critical(
+                f"The sample sheet is missing a header or some of its columns. It **must** contain these column "
+                f"headers: {req_cols}. It currently contains {header}"
+            )
             sys.exit(1)
-        # Validate each row.
-        checker = RowChecker()
-        for i, row in enumerate(reader):
-            try:
-                checker.validate_and_transform(row)
-            except AssertionError as error:
-                logger.critical(f"{str(error)} On line {i + 2}.")
-                sys.exit(1)
-        checker.validate_unique_samples()
-    header = list(reader.fieldnames)
-    header.insert(1, "single_end")
-    # See https://docs.python.org/3.9/library/csv.html#id3 to read up on `newline=""`.
-    with file_out.open(mode="w", newline="") as out_handle:
-        writer = csv.DictWriter(out_handle, header, delimiter=",")
-        writer.writeheader()
-        for row in checker.modified:
+        # Resolve the column positions once instead of looking them up by name on every row.
+        sample_idx, vcf_idx, traits_idx, ancestry_idx = (
+            header.index(column) for column in ("sample", "vcf", "traits", "ancestry")
+        )
+        output_header = list(header)
+        output_header.insert(1, "single_end")
+        # See https://docs.python.org/3.9/library/csv.html#id3 to read up on `newline=""`.
+        try:
+            with file_out.open(mode="w", newline="", buffering=BUFFER_SIZE) as out_handle:
+                writer = csv.writer(out_handle, delimiter=",")
+                writer.writerow(output_header)
+                # Validate each row and stream it straight to the output, ignoring blank lines.
+                checker = RowChecker(
+                    width=len(header), sample=sample_idx, vcf=vcf_idx, traits=traits_idx, ancestry=ancestry_idx
+                )
+                try:
+                    write_rows(out_handle, writer, (checker.validate_and_transform(row) for row in reader if row))
+                except AssertionError as error:
+                    logger.critical(f"{str(error)} On line {reader.line_num}.")
+                    sys.exit(1)
+        except BaseException:
+            # Do not leave a partially written samplesheet behind, whatever the failure.
+            file_out.unlink(missing_ok=True)
+            raise
+
+
+def write_rows(handle, writer, rows):
+    """
+    Write the given rows as CSV, bypassing ``csv.writer`` whenever no quoting is needed.
+
+    Rows whose fields contain no delimiter, quote or line break are joined directly and
+    flushed to the handle in batches of about ``BUFFER_SIZE`` characters. Any other row
+    is written by the given writer so that it is quoted properly.
+
+    Args:
+        handle (text file): The handle the writer is bound to.
+        writer (csv.writer): A comma-delimited writer used for rows that need quoting.
+        rows (iterable): The rows to write, each a list of strings.
+
+    """
+    terminator = writer.dialect.lineterminator
+    buffer = []
+    size = 0
+    for row in rows:
+        line = ",".join(row)
+        if line.count(",") != len(row) - 1 or '"' in line or "\r" in line or "\n" in line:
+            handle.write("".join(buffer))
+            buffer.clear()
+            size = 0
             writer.writerow(row)
+            continue
+        buffer.append(line)
+        buffer.append(terminator)
+        size += len(line)
+        if size >= BUFFER_SIZE:
+            handle.write("".join(buffer))
+            buffer.clear()
+            size = 0
+    handle.write("".join(buffer))
 
 
 def parse_args(argv=None):
@@ -203,6 +329,11 @@ def parse_args(argv=None):
         type=Path,
         help="Transformed output samplesheet in CSV format.",
     )
+    parser.add_argument(
+        "--sniff",
+        action="store_true",
+        help="Detect the input format with csv.Sniffer instead of the header delimiter.",
+    )
     parser.add_argument(
         "-l",
         "--log-level",
@@ -221,7 +352,7 @@ def main(argv=None):
         logger.error(f"The given input file {args.file_in} was not found!")
         sys.exit(2)
     args.file_out.parent.mkdir(parents=True, exist_ok=True)
-    check_samplesheet(args.file_in, args.file_out)
+    check_samplesheet(args.file_in, args.file_out, sniff=args.sniff)
 
 
 if __name__ == "__main__":